@@ -16,7 +16,7 @@ if __name__ == '__main__':
     if args.validation:
         run_validation(dti_prediction_model, train_params, output_file, train_dic, test_dic)
     elif args.predict:
-        run_prediction(dti_prediction_model, train_params, output_file, train_dic, test_dic)
+        run_prediction(dti_prediction_model, train_params, output_file, train_dic, test_dic, args.output_format)
 
     # save trained model
     if args.save_model:
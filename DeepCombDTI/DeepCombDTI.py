@@ -18,9 +18,44 @@ from keras.utils.training_utils import multi_gpu_model
 from keras.backend.tensorflow_backend import set_session
 from keras.wrappers.scikit_learn import KerasClassifier
 from keras.callbacks import ModelCheckpoint
+from keras.utils import Sequence
 import os
 
 
+# slice features of a branch from the concatenated input
+def slice_feature(x, start, end):
+    return x[:, start:end]
+
+
+# batch generator which gathers feature rows per batch, so that Keras can prefetch batches while the model trains
+class DTI_Sequence(Sequence):
+    def __init__(self, features, label, batch_size, shuffle=False):
+        self.__features = features
+        self.__label = np.asarray(label)
+        self.__batch_size = batch_size
+        self.__shuffle = shuffle
+        self.__indices = np.arange(self.__label.shape[0])
+        if self.__shuffle: np.random.shuffle(self.__indices)
+
+    def __len__(self):
+        return int(np.ceil(self.__indices.shape[0] / self.__batch_size))
+
+    def __getitem__(self, i):
+        # sorted row indices keep reads from (memory-mapped) features sequential
+        batch = np.sort(self.__indices[i*self.__batch_size:(i+1)*self.__batch_size])
+
+        # concatenate drug and protein features into one contiguous input per batch
+        return np.concatenate([feature[batch] for feature in self.__features], axis=1), self.__label[batch]
+
+    def on_epoch_end(self):
+        if self.__shuffle: np.random.shuffle(self.__indices)
+
+
+# build a batch generator for training (shuffled) or prediction (ordered)
+def make_dataset(features, label, batch_size, training):
+    return DTI_Sequence(features, label, batch_size, shuffle=training)
+
+
 class Drug_Target_Prediction(object):
     def model(self, drug_vecs, drug_lens, drug_layers_list,
               prot_vec, prot_len, protein_layers_list, fc_layers_list,
@@ -36,11 +71,15 @@ class Drug_Target_Prediction(object):
         regularizer_param = 0.001
         params_dic = {"kernel_initializer": initializer, "kernel_regularizer": l2(regularizer_param)}
         
-        inputs = []; model_ts = []
+        # construct a single input of concatenated drug and protein features (split per branch in the graph)
+        input_t = Input(shape=(sum(drug_lens) + prot_len, ))
+        input_p = Lambda(slice_feature, output_shape=(prot_len, ), arguments={'start': sum(drug_lens), 'end': sum(drug_lens) + prot_len})(input_t)
+
+        model_ts = []; offset = 0
         for drug_len, drug_layers, protein_layers, fc_layers in zip(drug_lens, drug_layers_list, protein_layers_list, fc_layers_list):
             # construct drug layers
-            input_d = Input(shape=(drug_len, ))
-            inputs.append(input_d)
+            input_d = Lambda(slice_feature, output_shape=(drug_len, ), arguments={'start': offset, 'end': offset + drug_len})(input_t)
+            offset += drug_len
             input_layer_d = input_d
             for layer_size in drug_layers:
                 model_d = input_layer_d
@@ -50,9 +89,7 @@ class Drug_Target_Prediction(object):
                 model_d = Dropout(dropout)(model_d)
                 input_layer_d = model_d
 
-            # construct protein layers (input layer, hidden layers)
-            input_p = Input(shape=(prot_len,))
-            inputs.append(input_p)
+            # construct protein layers (hidden layers)
             input_layer_p = input_p
             protein_layers = return_tuple(protein_layers)
             for protein_layer in protein_layers:
@@ -77,7 +114,7 @@ class Drug_Target_Prediction(object):
          
         # construct a ensemble model
         max_model_t = layers.average(model_ts) 
-        model_ens = Model(inputs=inputs, outputs=max_model_t, name='ensemble')  
+        model_ens = Model(inputs=input_t, outputs=max_model_t, name='ensemble')  
 
         # optimize a model
         opt = Adam(lr=self.__learning_rate, decay=self.__decay)
@@ -110,12 +147,13 @@ class Drug_Target_Prediction(object):
         K.get_session().run(tf.global_variables_initializer())
 
     def fit(self, features, label, n_epoch, batch_size):
+        train_data = make_dataset(features, label, batch_size, training=True)
         for epoch in range(n_epoch):
             if not os.path.exists(self.__model_output + f'/{epoch}'): os.makedirs(self.__model_output + f'/{epoch}')
             model_path = self.__model_output + f'_{epoch+1:03d}.ckpt'
             if os.path.exists(model_path): self.__model_t.load_weights(model_path)
             checkpoint = ModelCheckpoint(filepath=model_path, save_weights_only=True, verbose=0)
-            self.__model_t.fit(features, label, initial_epoch=epoch, epochs=epoch+1, batch_size=batch_size, shuffle=True, verbose=1, callbacks=[checkpoint])
+            self.__model_t.fit_generator(train_data, initial_epoch=epoch, epochs=epoch+1, max_queue_size=10, workers=1, verbose=1, callbacks=[checkpoint])
 
         return self.__model_t
     
@@ -133,19 +171,20 @@ class Drug_Target_Prediction(object):
             result_df['epoch'] = range(1,n_epoch+1)
         result_dic = {dataset: {'AUC': [], 'AUPR': [], 'opt_threshold(AUPR)':[], 'opt_threshold(AUC)':[] }for dataset in kwargs}
         
+        train_data = make_dataset(features, label, batch_size, training=True)
         for epoch in range(n_epoch):
             if not os.path.exists(self.__model_output + f'/{epoch}'): os.makedirs(self.__model_output + f'/{epoch}')
             model_path = self.__model_output + f'_{epoch+1:03d}.ckpt'
             if os.path.exists(model_path): self.__model_t.load_weights(model_path)
             checkpoint = ModelCheckpoint(filepath=model_path, save_weights_only=True, verbose=0)
-            self.__model_t.fit(features, label, initial_epoch=epoch, epochs=epoch+1, batch_size=batch_size, shuffle=True, verbose=1, callbacks=[checkpoint])
+            self.__model_t.fit_generator(train_data, initial_epoch=epoch, epochs=epoch+1, max_queue_size=10, workers=1, verbose=1, callbacks=[checkpoint])
             for dataset in kwargs:
                 print('\tPredction of', dataset)
                 
                 # prediction
                 test_f = kwargs[dataset]['features']
                 test_label = kwargs[dataset]['label']
-                prediction = self.__model_t.predict(test_f)
+                prediction = self.__model_t.predict_generator(make_dataset(test_f, test_label, batch_size, training=False), max_queue_size=10, workers=1)
                 
                 # get performances (AUC, AUPR)
                 fpr, tpr, thresholds_AUC = roc_curve(test_label, prediction)
@@ -156,7 +195,7 @@ class Drug_Target_Prediction(object):
                 # get optimal thresholds (AUC, AUPR)
                 distance = (1-fpr)**2 + (1-tpr)**2
                 EERs = (1-recall) / (1-precision)
-                positive = sum(test_label)
+                positive = int(np.sum(test_label))
                 negative = test_label.shape[0] - positive
                 ratio = negative / positive
                 opt_t_AUC = thresholds_AUC[np.argmin(distance)]
@@ -188,7 +227,7 @@ class Drug_Target_Prediction(object):
 
         return 
 
-    def predict(self, **kwargs):
+    def predict(self, batch_size=32, **kwargs):
         results_dic = {}
         for dataset in kwargs:
             # get test data
@@ -197,7 +236,7 @@ class Drug_Target_Prediction(object):
             test_label = kwargs[dataset]['label']
             
             # predict and save prediction results
-            prediction = self.__model_t.predict(test_f)
+            prediction = self.__model_t.predict_generator(make_dataset(test_f, test_label, batch_size, training=False), max_queue_size=10, workers=1)
             fpr, tpr, thresholds_AUC = roc_curve(test_label, prediction)
             AUC = auc(fpr, tpr)
             precision, recall, thresholds = precision_recall_curve(test_label, prediction)
@@ -206,7 +245,7 @@ class Drug_Target_Prediction(object):
             # get optimal thresholds (AUC, AUPR)
             distance = (1-fpr)**2 + (1-tpr)**2
             EERs = (1-recall) / (1-precision)
-            positive = sum(test_label)
+            positive = int(np.sum(test_label))
             negative = test_label.shape[0] - positive
             ratio = negative / positive
             
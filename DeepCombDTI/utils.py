@@ -16,9 +16,261 @@ from sklearn.metrics import precision_recall_curve, auc, roc_curve
 # import other modules
 import os
 import random
+import hashlib
+import csv
+import gc
+import functools
+import warnings
+import tempfile
+import atexit
+
+# import numba if available (used for parsing large feature tables)
+try:
+    from numba import njit, prange
+except ImportError:
+    njit = None
+
+# import pyarrow if available (used for parquet data and writing prediction results)
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+# minimum number of rows to parse feature strings with the numba kernel (float32 features only)
+NUMBA_MIN_ROWS = 10000
+
+# minimum number of values to parse feature strings with np.fromstring
+FROMSTRING_MIN_VALUES = 1000000
+
+# get row positions of ids in a table index (the last row is used for duplicated ids)
+def get_row_indexer(index, ids):
+    if index.is_unique:
+        indexer = index.get_indexer(ids)
+    else:
+        last = ~index.duplicated(keep='last')
+        indexer = index[last].get_indexer(ids)
+        indexer = np.where(indexer < 0, -1, np.flatnonzero(last)[indexer])
+    missing = indexer < 0
+    if missing.any():
+        raise KeyError('Unknown IDs: {0}'.format(', '.join(map(str, pd.unique(ids[missing])[:10]))))
+    return indexer
+
+# parse tab-delimited float strings into a pre-allocated matrix
+# buf holds rows terminated by '\n' and offsets[r] is the start position of row r
+# returns the number of rows with invalid values or a wrong number of columns
+if njit is not None:
+    @njit(parallel=True)
+    def parse_tsv_floats(buf, offsets, out):
+        n_rows, n_cols = out.shape
+        errors = 0
+        for r in prange(n_rows):
+            pos = offsets[r]
+            end = offsets[r + 1] - 1
+            valid = True
+            for c in range(n_cols):
+                # sign
+                sign = 1.0
+                if pos < end and buf[pos] == 45:
+                    sign = -1.0; pos += 1
+                elif pos < end and buf[pos] == 43:
+                    pos += 1
+
+                # integer and fraction digits
+                value = 0.0; scale = 1.0; digits = 0
+                while pos < end and buf[pos] >= 48 and buf[pos] <= 57:
+                    value = value * 10.0 + (buf[pos] - 48); pos += 1; digits += 1
+                if pos < end and buf[pos] == 46:
+                    pos += 1
+                    while pos < end and buf[pos] >= 48 and buf[pos] <= 57:
+                        value = value * 10.0 + (buf[pos] - 48); scale *= 10.0; pos += 1; digits += 1
+                value /= scale
+
+                # exponent
+                if digits > 0 and pos < end and (buf[pos] == 101 or buf[pos] == 69):
+                    pos += 1
+                    exp_sign = 1; exponent = 0
+                    if pos < end and buf[pos] == 45:
+                        exp_sign = -1; pos += 1
+                    elif pos < end and buf[pos] == 43:
+                        pos += 1
+                    while pos < end and buf[pos] >= 48 and buf[pos] <= 57:
+                        exponent = exponent * 10 + (buf[pos] - 48); pos += 1
+                    value *= 10.0 ** (exp_sign * exponent)
+                out[r, c] = sign * value
+
+                # separator
+                if digits == 0 or (c < n_cols - 1 and (pos >= end or buf[pos] != 9)):
+                    valid = False
+                    break
+                pos += 1
+            if not valid or pos != end + 1:
+                errors += 1
+        return errors
+
+    # gather rows of a matrix into a pre-allocated array in parallel
+    @njit(parallel=True)
+    def take_rows(matrix, indexer, out):
+        for r in prange(indexer.shape[0]):
+            out[r, :] = matrix[indexer[r], :]
+else:
+    parse_tsv_floats = None
+    take_rows = None
+
+# split tab-delimited feature strings into a matrix
+def split_features(values, feature_dtype="float32"):
+    # the numba kernel accepts plain decimal numbers only, other values (e.g. nan, inf, whitespace)
+    # are parsed again by the exact paths below
+    if parse_tsv_floats is not None and len(values) >= NUMBA_MIN_ROWS and np.dtype(feature_dtype) == np.float32:
+        try:
+            buf = np.frombuffer(('\n'.join(values.to_numpy()) + '\n').encode('ascii'), dtype=np.uint8)
+        except UnicodeEncodeError:
+            buf = None
+        if buf is not None:
+            offsets = np.concatenate([[0], np.flatnonzero(buf == ord('\n')) + 1])
+            out = np.empty((len(values), values.iloc[0].count('\t') + 1), dtype=feature_dtype)
+            if not parse_tsv_floats(buf, offsets, out):
+                return out
+
+    # every row must have the same number of values (np.fromstring only sees the total number of values)
+    n_cols = values.iloc[0].count('\t') + 1 if len(values) else 0
+    if not (values.str.count('\t') == n_cols - 1).all():
+        raise ValueError('Inconsistent feature vector lengths in {0}'.format(values.name))
+
+    if len(values) * n_cols >= FROMSTRING_MIN_VALUES:
+        # parse all rows at once with a single C call
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', DeprecationWarning)
+            try:
+                out = np.fromstring('\t'.join(values.to_numpy()), dtype=feature_dtype, sep='\t')
+            except (ValueError, DeprecationWarning):
+                out = None
+        if out is None or out.size != len(values) * n_cols:
+            raise ValueError('Invalid or inconsistent feature vectors in {0}'.format(values.name))
+        return out.reshape(len(values), n_cols)
+    return values.str.split("\t", expand=True).to_numpy(dtype=feature_dtype)
+
+# check whether a data file is a parquet file (written by preprocess.py)
+def is_parquet(data_dir):
+    if not data_dir.endswith('.parquet'): return False
+    if pa is None: raise ImportError('pyarrow is required to read parquet files')
+    return True
+
+# read DTI data in chunks from a csv or parquet file
+def read_dti_chunks(dti_dir, columns, dtype, chunksize=500000):
+    if is_parquet(dti_dir):
+        for batch in pq.ParquetFile(dti_dir).iter_batches(batch_size=chunksize, columns=columns):
+            yield batch.to_pandas().astype(dtype)
+    else:
+        yield from pd.read_csv(dti_dir, usecols=columns, dtype=dtype, chunksize=chunksize)
+
+# read columns of a csv file with pyarrow, falling back to the default C engine
+# (column types are applied while parsing, so IDs such as '007' keep their leading zeros)
+def read_csv(csv_dir, usecols, dtype, index_col=None):
+    df = None
+    if pa is not None:
+        convert_options = pa_csv.ConvertOptions(column_types={col: pa.type_for_alias(dtype[col]) for col in dtype}, include_columns=usecols)
+        try:
+            df = pa_csv.read_csv(csv_dir, convert_options=convert_options).to_pandas().astype(dtype)
+        except pa.ArrowInvalid:
+            df = None
+    if df is None:
+        df = pd.read_csv(csv_dir, usecols=usecols, dtype=dtype)
+    return df.set_index(index_col) if index_col else df
+
+# save an array as .npy file atomically (an interrupted write never leaves a truncated file)
+def save_npy(npy_path, array):
+    tmp_path = '{0}.{1}.tmp'.format(npy_path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        np.save(f, array)
+    os.replace(tmp_path, npy_path)
+
+# load a feature column as a matrix, keeping parsed matrices in memory (shared by train and test data)
+# and caching them as .npy files
+def load_feature_matrix(csv_dir, id_col, vec_col, feature_dtype="float32", cache_dir=None):
+    csv_dir = os.path.abspath(csv_dir)
+    return _load_feature_matrix(csv_dir, os.path.getmtime(csv_dir), id_col, vec_col, feature_dtype, cache_dir)
+
+@functools.lru_cache(maxsize=None)
+def _load_feature_matrix(csv_dir, mtime, id_col, vec_col, feature_dtype, cache_dir):
+    # parquet files store features as fixed size float lists, read without parsing (zero-copy if possible)
+    if is_parquet(csv_dir):
+        table = pq.read_table(csv_dir, columns=[id_col, vec_col])
+        index = pd.Index(table.column(id_col).to_pandas(), dtype='string')
+        vectors = table.column(vec_col).combine_chunks()
+        matrix = vectors.flatten().to_numpy(zero_copy_only=False).reshape(len(vectors), vectors.type.list_size)
+        matrix = matrix.astype(feature_dtype, copy=False)
+        matrix.flags.writeable = False
+        return index, matrix
+
+    if cache_dir:
+        key = '\0'.join(map(str, [csv_dir, mtime, id_col, vec_col, feature_dtype]))
+        cache_path = os.path.join(cache_dir, hashlib.md5(key.encode()).hexdigest())
+        if os.path.exists(cache_path + '.npy') and os.path.exists(cache_path + '_index.npy'):
+            index = pd.Index(np.load(cache_path + '_index.npy'))
+            matrix = np.load(cache_path + '.npy', mmap_mode='r')
+            return index, matrix
+
+    df = read_csv(csv_dir, [id_col, vec_col], {id_col: 'string', vec_col: 'string'}, index_col=id_col)
+    index = df.index
+    matrix = split_features(df[vec_col], feature_dtype)
+    matrix.flags.writeable = False
+
+    if cache_dir:
+        # the index is written last, so a complete pair of files is always valid
+        os.makedirs(cache_dir, exist_ok=True)
+        save_npy(cache_path + '.npy', matrix)
+        save_npy(cache_path + '_index.npy', index.to_numpy(dtype=str))
+    return index, matrix
+
+# binary features stored as packed bits (8 features per byte), unpacked when rows are indexed
+class Packed_Feature(object):
+    def __init__(self, packed, length, dtype="float32"):
+        self.__packed = packed
+        self.__length = length
+        self.__dtype = dtype
+        self.shape = (packed.shape[0], length)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, rows):
+        return np.unpackbits(self.__packed[rows], axis=1, count=self.__length).astype(self.__dtype)
+
+# check whether a feature matrix has only 0/1 values
+def is_binary(matrix):
+    return bool(((matrix == 0) | (matrix == 1)).all())
+
+# remove a file, or at exit where an open file cannot be removed (e.g. a mapped file on Windows)
+def remove_file(file_path):
+    try:
+        os.remove(file_path)
+    except OSError:
+        atexit.register(lambda: os.path.exists(file_path) and os.remove(file_path))
+
+# gather matrix rows into a pre-allocated (optionally memory-mapped) array block by block
+def gather_rows(matrix, indexer, out_dir=None, chunksize=500000):
+    shape = (indexer.shape[0], matrix.shape[1])
+    if out_dir:
+        # each call maps its own temporary file, removed at once (the mapping stays valid until it is released)
+        os.makedirs(out_dir, exist_ok=True)
+        fd, out_path = tempfile.mkstemp(suffix='_dti.npy', dir=out_dir)
+        os.close(fd)
+        out = np.lib.format.open_memmap(out_path, mode='w+', dtype=matrix.dtype, shape=shape)
+        remove_file(out_path)
+    else:
+        out = np.empty(shape, dtype=matrix.dtype)
+    if take_rows is not None and matrix.dtype in (np.uint8, np.float32, np.float64):
+        take_rows(np.asarray(matrix), indexer, np.asarray(out))
+        return out
+    for start in range(0, shape[0], chunksize):
+        end = start + chunksize
+        np.take(matrix, indexer[start:end], axis=0, out=out[start:end])
+    return out
 
 # parse data
-def parse_data(dti_dir, drug_dir, protein_dir, drug_vecs, drug_lens, prot_vec, prot_len, parsing=True):
+def parse_data(dti_dir, drug_dir, protein_dir, drug_vecs, drug_lens, prot_vec, prot_len, feature_dtype="float32", cache_dir=None, chunksize=500000, parsing=True):
     if not parsing: return {"features": [], "label": []}
     print('Parsing {0}, {1}'.format(*[dti_dir, drug_dir]))
 
@@ -26,33 +278,82 @@ def parse_data(dti_dir, drug_dir, protein_dir, drug_vecs, drug_lens, prot_vec, p
     drug_col = "Compound_ID"
     protein_col = "Protein_ID"
     label_col = "Label"
-        
-    # load DTI, drug, protein data
-    dti_df = pd.read_csv(dti_dir)
-    drug_df = pd.read_csv(drug_dir, index_col="Compound_ID")
-    protein_df = pd.read_csv(protein_dir, index_col="Protein_ID")
-
 
-    features = []
+    # load drug, protein feature matrices
+    prot_index, prot_mat = load_feature_matrix(protein_dir, protein_col, prot_vec, feature_dtype, cache_dir)
+    drug_index = None; drug_mats = []
     for drug_vec in drug_vecs:
-        # Extract drug features
-        drug_dic = drug_df[drug_vec].map(lambda fp: fp.split("\t")).to_dict()
-        drug_feature = np.array(list(dti_df[drug_col].map(lambda drug: drug_dic[drug])), dtype=np.float64)
+        drug_index, drug_mat = load_feature_matrix(drug_dir, drug_col, drug_vec, feature_dtype, cache_dir)
+        drug_mats.append(drug_mat)
+        del drug_mat
+
+    # stream DTI data and map rows to drug and protein table rows
+    drug_idx = []; prot_idx = []; labels = []
+    dti_chunks = read_dti_chunks(dti_dir, [drug_col, protein_col, label_col], {drug_col: 'string', protein_col: 'string', label_col: 'int8'}, chunksize)
+    for chunk in dti_chunks:
+        if drug_index is not None: drug_idx.append(get_row_indexer(drug_index, chunk[drug_col].to_numpy()))
+        prot_idx.append(get_row_indexer(prot_index, chunk[protein_col].to_numpy()))
+        labels.append(chunk[label_col].to_numpy())
+    drug_idx = np.concatenate(drug_idx) if drug_idx else None
+    prot_idx = np.concatenate(prot_idx)
 
-        # Extract protein features
-        prot_dic= protein_df[prot_vec].map(lambda seq: [float(i) for i in seq.split("\t")]).to_dict()
-        protein_feature = np.array(list(dti_df[protein_col].map(lambda protein: prot_dic[protein])), dtype=np.float64)
+    features = []
+    for i, drug_vec in enumerate(drug_vecs):
+        # Extract drug features (binary fingerprints are kept as packed bits)
+        if is_binary(drug_mats[i]):
+            packed_mat = np.packbits(np.asarray(drug_mats[i], dtype=np.uint8), axis=1)
+            drug_feature = Packed_Feature(gather_rows(packed_mat, drug_idx, cache_dir, chunksize), drug_mats[i].shape[1], feature_dtype)
+            del packed_mat
+        else:
+            drug_feature = gather_rows(drug_mats[i], drug_idx, cache_dir, chunksize)
 
         features.append(drug_feature)
-        features.append(protein_feature)
+
+    # Extract protein features (shared by every drug feature type, concatenated after drug features)
+    features.append(gather_rows(prot_mat, prot_idx, cache_dir, chunksize))
     
     # Extract labels
-    label =  dti_df[label_col].values
+    label = np.concatenate(labels)
+    positive = int(label.sum())
+    negative = label.size - positive
+
+    print("\tPositive data : %d" %(positive))
+    print("\tNegative data : %d" %(negative))
 
-    print("\tPositive data : %d" %(sum(dti_df[label_col])))
-    print("\tNegative data : %d" %(dti_df.shape[0] - sum(dti_df[label_col])))
+    # free intermediate tables and indexers before the model allocates its buffers
+    del prot_index, prot_mat, drug_index, drug_mats, drug_idx, prot_idx, labels, dti_chunks
+    gc.collect()
     return {"features": features, "label": label}
 
+# convert DTI, drug and protein csv files to parquet files (dti.parquet, drug.parquet, protein.parquet)
+# which parse_data reads without parsing feature strings
+def convert_to_parquet(dti_dir, drug_dir, protein_dir, drug_vecs, prot_vec, output_dir, feature_dtype="float32"):
+    if pa is None: raise ImportError('pyarrow is required to write parquet files')
+    os.makedirs(output_dir, exist_ok=True)
+
+    # set column names
+    drug_col = "Compound_ID"
+    protein_col = "Protein_ID"
+    label_col = "Label"
+
+    # convert DTI data
+    print('Converting {0}'.format(dti_dir))
+    dti_df = read_csv(dti_dir, [drug_col, protein_col, label_col], {drug_col: 'string', protein_col: 'string', label_col: 'int8'})
+    pq.write_table(pa.Table.from_pandas(dti_df, preserve_index=False), os.path.join(output_dir, 'dti.parquet'))
+
+    # convert drug, protein features to fixed size lists
+    for data_dir, id_col, vecs, name in [(drug_dir, drug_col, drug_vecs, 'drug'), (protein_dir, protein_col, [prot_vec], 'protein')]:
+        print('Converting {0}'.format(data_dir))
+        columns = {}
+        for vec in vecs:
+            index, matrix = load_feature_matrix(data_dir, id_col, vec, feature_dtype)
+            if id_col not in columns: columns[id_col] = pa.array(index.to_numpy(dtype=str))
+            columns[vec] = pa.FixedSizeListArray.from_arrays(pa.array(np.ascontiguousarray(matrix).ravel()), matrix.shape[1])
+        pq.write_table(pa.table(columns), os.path.join(output_dir, name + '.parquet'))
+
+    # release parsed drug, protein matrices
+    _load_feature_matrix.cache_clear()
+
 def get_args():
     import argparse
     
@@ -61,6 +362,7 @@ def get_args():
         Deep learning model will be built by Keras with tensorflow.\n
         You can set almost hyper-parameters as you want, See below parameter description\n
         DTI, drug and protein data must be written as csv file format. And feature should be tab-delimited format for script to parse data.\n
+        DTI, drug and protein data can also be given as parquet files converted by preprocess.py.\n
         \n
         requirement\n
         ============================\n
@@ -114,9 +416,14 @@ def get_args():
     parser.add_argument("--validation", help="Excute validation with independent data, will give AUC and AUPR (No prediction result)", action="store_true")
     parser.add_argument("--predict", help="Predict interactions of independent test set", action="store_true")
     
+    # parsing_params
+    parser.add_argument("--feature-dtype", help="Data type of parsed drug and protein features", default="float32", choices=["float16", "float32", "float64"], type=str)
+    parser.add_argument("--cache-dir", help="Directory to cache parsed feature matrices as .npy files (also used for temporary memory-mapped DTI features)", default=None, type=str)
+    
     # output_params
     parser.add_argument("--model-output", "-m", help="Model output", default=None, type=str)
     parser.add_argument("--output", "-o", help="Prediction output", default=None, type=str)
+    parser.add_argument("--output-format", help="File format of prediction output", default="csv", choices=["csv", "parquet"], type=str)
     
     return parser.parse_args()
 
@@ -151,6 +458,12 @@ def get_params(args):
         "prot_len": args.prot_len,
     }
     
+    # parsing parameter
+    parse_params = {
+        "feature_dtype": args.feature_dtype,
+        "cache_dir": args.cache_dir,
+    }
+    
     # model parameter
     model_params = {
         'drug_layers_list': [list(map(int, drug_layers.split(','))) for drug_layers in args.drug_layers_list],
@@ -172,17 +485,45 @@ def get_params(args):
     
     # set train data
     train_dic.update(type_params)
+    train_dic.update(parse_params)
     train_dic = parse_data(**train_dic)
     
-    # set test data
-    test_sets = zip(args.test_name, args.test_dti_dir, args.test_drug_dir, args.test_protein_dir)
-    test_dic = {
-        test_name: parse_data(test_dti, test_drug, test_protein, **type_params)
-        for test_name, test_dti, test_drug, test_protein in test_sets
-    }
+    # set test data (test sets given with the same files share parsed features)
+    test_names = args.test_name or []
+    test_dirs = [args.test_dti_dir or [], args.test_drug_dir or [], args.test_protein_dir or []]
+    if any(len(dirs) != len(test_names) for dirs in test_dirs):
+        raise ValueError('--test-name, --test-dti-dir, --test-drug-dir and --test-protein-dir must have the same number of values')
+    parsed_dic = {}
+    if args.parsing_train:
+        parsed_dic[tuple(map(os.path.abspath, (args.dti_dir, args.drug_dir, args.protein_dir)))] = train_dic
+    test_dic = {}
+    for test_name, test_files in zip(test_names, zip(*test_dirs)):
+        test_key = tuple(map(os.path.abspath, test_files))
+        if test_key not in parsed_dic:
+            parsed_dic[test_key] = parse_data(*test_files, **type_params, **parse_params)
+        test_dic[test_name] = parsed_dic[test_key]
+    
+    # release parsed drug, protein matrices
+    _load_feature_matrix.cache_clear()
     
     return train_dic, test_dic, train_params, type_params, model_params, output_file
 
+# save a dataframe as csv or parquet file with pyarrow writers (pandas writer if pyarrow is not available)
+def save_table(df, output_file, output_format="csv"):
+    if output_format == "parquet":
+        if pa is None: raise ImportError('pyarrow is required to save results as parquet')
+        if isinstance(df.columns, pd.MultiIndex): df = df.set_axis(['_'.join(map(str, column)) for column in df.columns], axis=1)
+        pq.write_table(pa.Table.from_pandas(df, preserve_index=False), output_file)
+    elif pa is None:
+        df.to_csv(output_file, index=False)
+    else:
+        # write header rows (one row per column level) as pandas does, then the rows by pyarrow
+        with open(output_file, 'w', newline='') as f:
+            csv.writer(f).writerows(zip(*df.columns) if isinstance(df.columns, pd.MultiIndex) else [df.columns])
+        with open(output_file, 'ab') as f:
+            table = pa.Table.from_pandas(df.set_axis(list(map(str, range(df.shape[1]))), axis=1), preserve_index=False)
+            pa_csv.write_csv(table, f, write_options=pa_csv.WriteOptions(include_header=False))
+
 def run_validation(dti_prediction_model, train_params, output_file, train_dic, test_dic):
     print('Validation')
     
@@ -197,28 +538,23 @@ def run_validation(dti_prediction_model, train_params, output_file, train_dic, t
     dti_prediction_model.validation(**validation_params)
     print('Validation is completed.\n')
 
-def run_prediction(dti_prediction_model, train_params, output_file, train_dic, test_dic):
+def run_prediction(dti_prediction_model, train_params, output_file, train_dic, test_dic, output_format="csv"):
     print('Prediction')
     
     # fit the model and predict
-    train_dic.update(train_params)
-    dti_prediction_model.fit(**train_dic)
-    test_predicted = dti_prediction_model.predict(**test_dic)
+    dti_prediction_model.fit(**train_dic, **train_params)
+    test_predicted = dti_prediction_model.predict(batch_size=train_params["batch_size"], **test_dic)
     
-    # save prediction results as dataframe
-    result_df = pd.DataFrame()
+    # save prediction results as dataframe (columns may have different lengths)
+    result_values = []
     result_columns = []
     for dataset in test_predicted:
         # extract prediction results
-        value = np.squeeze(test_predicted[dataset]['predicted'])
-        
-        # save prediction results as dataframe
-        temp_df = pd.DataFrame()
-        temp_df[dataset,'predicted'] = value
-        temp_df[dataset, 'label'] = np.squeeze(test_predicted[dataset]['label'])
-        result_df = pd.concat([result_df, temp_df], ignore_index=True, axis=1)
+        result_values.append(pd.Series(np.ravel(test_predicted[dataset]['predicted'])))
+        result_values.append(pd.Series(np.ravel(test_predicted[dataset]['label'])))
         result_columns.append((dataset, 'predicted'))
         result_columns.append((dataset, 'label'))
+    result_df = pd.concat(result_values, ignore_index=True, axis=1) if result_values else pd.DataFrame()
         
     print('Prediction is completed.\n')
 
@@ -226,4 +562,4 @@ def run_prediction(dti_prediction_model, train_params, output_file, train_dic, t
     if output_file:
         print('save to %s' % output_file)
         result_df.columns = pd.MultiIndex.from_tuples(result_columns)
-        result_df.to_csv(output_file, index=False)
\ No newline at end of file
+        save_table(result_df, output_file, output_format)
@@ -0,0 +1,39 @@
+from DeepCombDTI.utils import convert_to_parquet
+
+def get_preprocess_args():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="""
+        This Python script converts DTI, drug and protein csv files to parquet files (dti.parquet, drug.parquet, protein.parquet).\n
+        Features are stored as float lists, so DeepCombDTI.py can read them without parsing tab-delimited strings.\n
+        Use the parquet files in place of the csv files (e.g. python DeepCombDTI.py out/dti.parquet out/drug.parquet out/protein.parquet ...).\n
+        \n
+        requirement\n
+        ============================\n
+        pyarrow\n
+        ============================\n
+    """)
+
+    # data_params
+    parser.add_argument("dti_dir", help="DTI information [drug, target, label]")
+    parser.add_argument("drug_dir", help="Drug information [drug, SMILES,[feature_name, ..]]")
+    parser.add_argument("protein_dir", help="Protein information [protein, seq, [feature_name]]")
+
+    # type_params
+    parser.add_argument("--drug-vecs", "-V", help="Types of drug feature", nargs="*", type=str, default="")
+    parser.add_argument("--prot-vec", "-v", help="Type of protein feature", type=str, default="")
+    parser.add_argument("--feature-dtype", help="Data type of stored drug and protein features", default="float32", choices=["float16", "float32", "float64"], type=str)
+
+    # output_params
+    parser.add_argument("--output-dir", "-o", help="Output directory of parquet files", required=True, type=str)
+
+    return parser.parse_args()
+
+if __name__ == '__main__':
+
+    # get parameters from arguments
+    args = get_preprocess_args()
+
+    # convert csv files to parquet files
+    convert_to_parquet(args.dti_dir, args.drug_dir, args.protein_dir, args.drug_vecs, args.prot_vec, args.output_dir, args.feature_dtype)
+    exit()